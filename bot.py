@@ -1,27 +1,82 @@
+import asyncio
+import hashlib
+import os
 import re
-from typing import Dict, Any, List
+import string
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
 from datetime import datetime
+from functools import lru_cache
 
 
+import httpx
 from langchain_groq import ChatGroq
 from langchain.memory import ConversationTokenBufferMemory
 from langchain.agents import Tool, initialize_agent, AgentType
 
 conversation_log: Dict[str, List[Dict[str, Any]]] = {}
+# One pooled HTTP/2 client carries every async Groq call in this process
+# (created per worker process; closed by the API's lifespan shutdown)
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(
+        max_connections=100, max_keepalive_connections=50, keepalive_expiry=30
+    ),
+    timeout=httpx.Timeout(60.0, connect=5.0),
+)
+
 # Initialize the main LLM used for:
 # 1) Intent classification
 # 2) Emotion-based generation
 # 3) Semantic conversation fallback
-llm = ChatGroq(model_name="llama-3.3-70b-versatile", temperature=0.2)
+llm = ChatGroq(
+    model_name="llama-3.3-70b-versatile",
+    temperature=0.2,
+    http_async_client=http_client,
+)
+
+# When disabled, messages the keyword router cannot place go straight to the
+# agent instead of paying for a classifier call first (self-harm wording
+# still never reaches the agent, see _unclassified).
+USE_SEMANTIC_INTENT = os.getenv("USE_SEMANTIC_INTENT", "1") == "1"
 
 
 # Global stores for per-session state:
 # - memory: conversation history (for context awareness)
 # - sessions: stores the user's name + marks
-# - agent_store: caches the agent instance per session
+# - agent_store: LRU cache of agent instances (only for sessions that hit the fallback)
+# sessions is kept in LRU order; past SESSION_STORE_MAX the least recently
+# used session is dropped from every store (see drop_session).
 memory_store: Dict[str, ConversationTokenBufferMemory] = {}
-sessions: Dict[str, Dict[str, Any]] = {}
-agent_store: Dict[str, Any] = {}
+sessions: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+agent_store: OrderedDict[str, Any] = OrderedDict()
+AGENT_STORE_MAX = 128
+SESSION_STORE_MAX = 10_000
+
+# Token budgets: tool prompts only need a short window,
+# the ReAct agent gets a larger one once it is built for a session
+MEMORY_TOKEN_LIMIT = 1500
+AGENT_MEMORY_TOKEN_LIMIT = 3000
+
+# Memory writes (token counting + pruning) run off the reply path.
+# A single worker keeps each session's turns saved in order.
+_MEM_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory")
+_MEMORY_LOCK = threading.Lock()
+# Rendered history per session: (save count, turns, text). remember() bumps
+# the session's save count, so a render from before any save is never reused.
+_history_cache: Dict[str, Tuple[int, int, str]] = {}
+_save_counts: Dict[str, int] = {}
+
+
+async def aclose() -> None:
+    """
+    Close the shared async HTTP client (call on server shutdown).
+    """
+    await http_client.aclose()
 
 
 def get_memory(session_id: str) -> ConversationTokenBufferMemory:
@@ -30,60 +85,129 @@ def get_memory(session_id: str) -> ConversationTokenBufferMemory:
     Keeps conversation context for the LLM agent.
     """
     if session_id not in memory_store:
-        memory_store[session_id] = ConversationTokenBufferMemory(
-            llm=llm,
-            max_token_limit=3000,
-            return_messages=True,
-            memory_key="chat_history",
-        )
+        with _MEMORY_LOCK:
+            if session_id not in memory_store:
+                memory_store[session_id] = ConversationTokenBufferMemory(
+                    llm=llm,
+                    max_token_limit=MEMORY_TOKEN_LIMIT,
+                    return_messages=True,
+                    memory_key="chat_history",
+                )
     return memory_store[session_id]
 
 
-def get_recent_history(session_id: str) -> str:
+def get_recent_history(session_id: str, k: int = 3) -> str:
     """
     Get readable USER/BOT history text for prompting tools.
+    Only the last k turns (user + bot message pairs) are included.
     """
+    saves = _save_counts.get(session_id, 0)
+    cached = _history_cache.get(session_id)
+    if cached is not None and cached[:2] == (saves, k):
+        return cached[2]
+
     msgs = (
         get_memory(session_id).load_memory_variables({}).get("chat_history", []) or []
     )
     lines = []
-    for m in msgs:
+    for m in msgs[-2 * k :]:
         role = "USER" if getattr(m, "type", "") == "human" else "BOT"
         lines.append(f"{role}: {m.content}")
-    return "\n".join(lines)
+    rendered = "\n".join(lines)
+    _history_cache[session_id] = (saves, k, rendered)
+    return rendered
+
+
+def remember(session_id: str, inp: str, out: str) -> None:
+    """
+    Save one turn to memory and invalidate the rendered history.
+    """
+    if session_id not in sessions:
+        return  # evicted while the write was queued
+    get_memory(session_id).save_context({"input": inp}, {"output": out})
+    _save_counts[session_id] = _save_counts.get(session_id, 0) + 1
+    _history_cache.pop(session_id, None)
+
+
+def remember_async(session_id: str, inp: str, out: str) -> None:
+    """
+    Queue remember() on the background memory worker.
+    """
+    _MEM_EXECUTOR.submit(remember, session_id, inp, out)
 
 
 def get_or_create_session(session_id: str) -> Dict[str, Any]:
     """
     Ensure the session exists and return its dictionary.
+    Least recently used sessions are evicted beyond SESSION_STORE_MAX.
     """
-    if session_id not in sessions:
-        sessions[session_id] = {"name": None, "marks": {}}
-    return sessions[session_id]
+    if session_id in sessions:
+        sessions.move_to_end(session_id)
+        return sessions[session_id]
+
+    while len(sessions) >= SESSION_STORE_MAX:
+        drop_session(next(iter(sessions)))
+    session = sessions[session_id] = {"name": None, "marks": {}}
+    return session
+
+
+def drop_session(session_id: str) -> None:
+    """
+    Forget everything stored for a session (state, memory, log, agent).
+    """
+    sessions.pop(session_id, None)
+    memory_store.pop(session_id, None)
+    conversation_log.pop(session_id, None)
+    agent_store.pop(session_id, None)
+    _history_cache.pop(session_id, None)
+    _save_counts.pop(session_id, None)
+
+
+# Intents whose reply is fully determined by session state (no LLM text),
+# so an earlier reply can be reused while that state is unchanged
+REUSABLE_INTENTS = frozenset({"academic"})
+
+
+def session_state(session_id: str) -> Optional[Tuple[Tuple[str, int], ...]]:
+    """
+    Hashable snapshot of the state reusable replies depend on (the marks).
+    None while the session has no name yet (next message sets it).
+    """
+    session = sessions.get(session_id)
+    if session is None or session["name"] is None:
+        return None
+    return tuple(session["marks"].items())
 
 
 # ---------------------------
 # Academic Score Processing
 # ---------------------------
 
+# Precompiled patterns for mark extraction.
+# One union regex matches both "Subject - Score" and "Score in Subject" forms
+# in a single pass; subject names are bounded to avoid heavy backtracking.
+SUBJECT_SCORE_RE = re.compile(
+    r"(?P<subj1>[A-Za-z][A-Za-z ]{0,30}?)\s*[-=:]\s*(?P<s1>\d{1,3})"
+    r"|(?P<s2>\d{1,3})\s+in\s+(?P<subj2>[A-Za-z][A-Za-z ]{0,30})",
+    re.IGNORECASE,
+)
+# Fallback "Subject Score" form, e.g. "English 88, Maths 90"
+SUBJ_SCORE_FALLBACK = re.compile(r"([A-Za-z][A-Za-z]{0,20})\s+(\d{1,3})\b")
+HAS_DIGIT_RE = re.compile(r"\d")
+
+
+# Grade letter for every score 0–100 (index = score)
+_GRADE_TABLE = tuple(
+    "F" * 40 + "E" * 10 + "D" * 10 + "C" * 10 + "B" * 10 + "A" * 10 + "S" * 11
+)
+
 
 def calculate_grade(score: int) -> str:
     """
     User-specific grading scale.
+    Scores outside 0–100 are clamped before the table lookup.
     """
-    if score >= 90:
-        return "S"
-    if score >= 80:
-        return "A"
-    if score >= 70:
-        return "B"
-    if score >= 60:
-        return "C"
-    if score >= 50:
-        return "D"
-    if score >= 40:
-        return "E"
-    return "F"
+    return _GRADE_TABLE[max(0, min(score, 100))]
 
 
 def parse_subject_scores(text: str):
@@ -96,26 +220,51 @@ def parse_subject_scores(text: str):
     """
     pairs = []
 
-    # Format: Subject - Score
-    for subj, score in re.findall(r"([A-Za-z ]+)\s*[-=:]\s*(\d{1,3})", text):
-        pairs.append((subj.strip().title(), int(score)))
-
-    # Format: Score in Subject
-    for score, subj in re.findall(
-        r"(\d{1,3})\s+in\s+([A-Za-z ]+)", text, flags=re.IGNORECASE
-    ):
-        pairs.append((subj.strip().title(), int(score)))
+    # Formats: Subject - Score | Score in Subject
+    for m in SUBJECT_SCORE_RE.finditer(text):
+        if m.group("s1") is not None:
+            pairs.append((m.group("subj1").strip().title(), int(m.group("s1"))))
+        else:
+            pairs.append((m.group("subj2").strip().title(), int(m.group("s2"))))
 
     # Format: Subject Score (fallback)
     if not pairs:
-        tokens = text.replace(",", " ").split()
-        for i in range(len(tokens) - 1):
-            if tokens[i + 1].isdigit():
-                pairs.append((tokens[i].strip().title(), int(tokens[i + 1])))
+        pairs.extend(
+            (m.group(1).title(), int(m.group(2)))
+            for m in SUBJ_SCORE_FALLBACK.finditer(text)
+        )
 
     return pairs
 
 
+NO_SCORES_REPLY = "I could not detect any valid subject scores."
+NO_MARKS_REPLY = "No marks saved yet."
+GRADE_SCALE = "(Scale: S≥90, A≥80, B≥70, C≥60, D≥50, E≥40, F<40)"
+
+
+@lru_cache(maxsize=256)
+def _render_table(title: str, items: Tuple[Tuple[str, int], ...]) -> str:
+    """
+    Render the marks table + overall grade.
+    Identical marks always render identically, so results are memoized.
+    """
+    lines = [
+        title,
+        "| Subject | Marks | Grade |",
+        "|--------|-------|-------|",
+    ]
+    # Single pass: sum scores while rendering rows
+    total = 0
+    for sub, sc in items:
+        total += sc
+        lines.append(f"| {sub} | {sc} | {calculate_grade(sc)} |")
+
+    avg = total / len(items)
+    lines.append("")
+    lines.append(f"Overall: {avg:.2f}% → Grade {calculate_grade(round(avg))}")
+    return "\n".join(lines)
+
+
 def add_or_update_marks(text: str, session_id: str) -> str:
     """
     Store or update marks, recalculate grade summary, return formatted table.
@@ -124,26 +273,13 @@ def add_or_update_marks(text: str, session_id: str) -> str:
     pairs = parse_subject_scores(text)
 
     if not pairs:
-        return "I could not detect any valid subject scores."
+        return NO_SCORES_REPLY
 
     for sub, sc in pairs:
-        marks[sub] = max(0, min(int(sc), 100))  # clamp 0–100
-
-    avg = sum(marks.values()) / len(marks)
-    grade = calculate_grade(int(round(avg)))
-
-    lines = [
-        "Updated Performance",
-        "| Subject | Marks | Grade |",
-        "|--------|-------|-------|",
-    ]
-    for sub, sc in marks.items():
-        lines.append(f"| {sub} | {sc} | {calculate_grade(sc)} |")
+        marks[sub] = min(sc, 100)  # clamp 0–100 (parsed scores are never negative)
 
-    lines.append("")
-    lines.append(f"Overall: {avg:.2f}% → Grade {grade}")
-    lines.append("(Scale: S≥90, A≥80, B≥70, C≥60, D≥50, E≥40, F<40)")
-    return "\n".join(lines)
+    table = _render_table("Updated Performance", tuple(marks.items()))
+    return f"{table}\n{GRADE_SCALE}"
 
 
 def show_marks_table(session_id: str) -> str:
@@ -152,21 +288,9 @@ def show_marks_table(session_id: str) -> str:
     """
     marks = get_or_create_session(session_id)["marks"]
     if not marks:
-        return "No marks saved yet."
+        return NO_MARKS_REPLY
 
-    avg = sum(marks.values()) / len(marks)
-    grade = calculate_grade(int(round(avg)))
-
-    lines = [
-        "Grade Summary",
-        "| Subject | Marks | Grade |",
-        "|--------|-------|-------|",
-    ]
-    for sub, sc in marks.items():
-        lines.append(f"| {sub} | {sc} | {calculate_grade(sc)} |")
-    lines.append("")
-    lines.append(f"Overall: {avg:.2f}% → Grade {grade}")
-    return "\n".join(lines)
+    return _render_table("Grade Summary", tuple(marks.items()))
 
 
 # ---------------------------
@@ -174,35 +298,53 @@ def show_marks_table(session_id: str) -> str:
 # ---------------------------
 
 
+# Static instructions lead each prompt so the prefix is identical every turn
+# (cache-friendly order: instructions → history → current message).
+# Interned and joined by plain concatenation instead of an f-string per call.
+POSITIVE_PREFIX = sys.intern(
+    "Respond supportive and uplifting in 2 sentences.\n\nConversation:\n"
+)
+NEGATIVE_PREFIX = sys.intern(
+    "Respond calm with one simple helpful suggestion. 2 sentences.\n\nConversation:\n"
+)
+USER_TAG = sys.intern("\n\nUser: ")
+
+
+def _tool_prompt(prefix: str, text: str, session_id: str) -> str:
+    return prefix + get_recent_history(session_id) + USER_TAG + text + "\n"
+
+
 def positive_prompt_tool(text: str, session_id: str):
     """
     Motivational and upbeat responses.
     Used when classifier detects a positive emotional context.
     """
-    prompt = f"""
-Conversation:
-{get_recent_history(session_id)}
+    prompt = _tool_prompt(POSITIVE_PREFIX, text, session_id)
+    return llm.invoke(prompt).content.strip()
 
-User: {text}
 
-Respond supportive and uplifting in 2 sentences.
-"""
-    return llm.invoke(prompt).content.strip()
+async def positive_prompt_tool_async(text: str, session_id: str):
+    """
+    Async variant of positive_prompt_tool.
+    """
+    prompt = _tool_prompt(POSITIVE_PREFIX, text, session_id)
+    return (await llm.ainvoke(prompt)).content.strip()
 
 
 def negative_prompt_tool(text: str, session_id: str):
     """
     Empathy + one quick actionable suggestion.
     """
-    prompt = f"""
-Conversation:
-{get_recent_history(session_id)}
+    prompt = _tool_prompt(NEGATIVE_PREFIX, text, session_id)
+    return llm.invoke(prompt).content.strip()
 
-User: {text}
 
-Respond calm with one simple helpful suggestion. 2 sentences.
-"""
-    return llm.invoke(prompt).content.strip()
+async def negative_prompt_tool_async(text: str, session_id: str):
+    """
+    Async variant of negative_prompt_tool.
+    """
+    prompt = _tool_prompt(NEGATIVE_PREFIX, text, session_id)
+    return (await llm.ainvoke(prompt)).content.strip()
 
 
 def student_marks_tool(text: str, session_id: str):
@@ -211,20 +353,23 @@ def student_marks_tool(text: str, session_id: str):
     If numbers detected → update marks
     Else → display the current grade table
     """
-    if re.search(r"\d", text):
+    if HAS_DIGIT_RE.search(text):
         return add_or_update_marks(text, session_id)
     return show_marks_table(session_id)
 
 
+SAFETY_REPLY = (
+    "I am sorry you are feeling like this.\n"
+    "Please reach out to someone who can support you.\n"
+    "India support lines: Aasra +91 9820466726 | iCall 022-25521111"
+)
+
+
 def self_harm_safety_tool(_: str, session_id: str):
     """
     Emergency supportive response when user expresses direct personal intent for self-harm.
     """
-    return (
-        "I am sorry you are feeling like this.\n"
-        "Please reach out to someone who can support you.\n"
-        "India support lines: Aasra +91 9820466726 | iCall 022-25521111"
-    )
+    return SAFETY_REPLY
 
 
 def clarification_question(_: str, __: str):
@@ -245,11 +390,22 @@ def get_agent(session_id: str):
     Builds and caches a LangChain agent for generic queries with:
     - Conversation memory
     - Tool access
+    Least recently used agents are evicted beyond AGENT_STORE_MAX.
     """
     if session_id in agent_store:
+        agent_store.move_to_end(session_id)
         return agent_store[session_id]
 
+    if len(agent_store) >= AGENT_STORE_MAX:
+        # Memory itself stays in memory_store; only the agent wrapper is dropped,
+        # so its memory goes back to the tool-prompt budget
+        evicted, _ = agent_store.popitem(last=False)
+        evicted_memory = memory_store.get(evicted)
+        if evicted_memory is not None:
+            evicted_memory.max_token_limit = MEMORY_TOKEN_LIMIT
+
     memory = get_memory(session_id)
+    memory.max_token_limit = AGENT_MEMORY_TOKEN_LIMIT
     tools = [
         Tool(
             "PositiveResponse",
@@ -290,19 +446,183 @@ def get_agent(session_id: str):
 
 
 # ---------------------------
-# Semantic Intent Classifier
+# Keyword Pre-Router
 # ---------------------------
 
+# Self-harm phrases are matched as substrings in one regex pass so they can
+# force the semantic classifier instead of being routed by keyword.
+INTENT_RE = re.compile(
+    r"(?P<safety>suicide|kill myself|want to die|end my life|hurt myself"
+    r"|no point living|cut myself)"
+)
+
+# Single-word keywords are checked by hashed token lookup.
+# Only academic and positive messages are routed by keyword; negative-mood
+# words can sit next to self-harm wording INTENT_RE does not list
+# ("suicidal", "tired of living"), so they always go to the classifier.
+ACADEMIC_WORDS = frozenset(
+    {
+        "grade", "grades", "score", "scores", "mark", "marks", "average",
+        "result", "results", "report", "reports", "table", "summary",
+    }
+)
+POSITIVE_WORDS = frozenset(
+    {"happy", "excited", "great", "awesome", "glad", "delighted"}
+)
+NEGATIVE_WORDS = frozenset(
+    {
+        "sad", "upset", "depressed", "stressed", "anxious", "worried",
+        "lonely", "tired", "angry", "frustrated", "overwhelmed",
+    }
+)
+KEYWORD_GROUPS = (
+    ("academic", ACADEMIC_WORDS),
+    ("positive", POSITIVE_WORDS),
+)
+# Negated messages ("not happy", "isn't great") flip the keyword's meaning
+NEGATION_WORDS = frozenset({"not", "no", "never", "nothing", "nobody"})
+
+
+def quick_intent(text: str) -> Optional[str]:
+    """
+    Cheap keyword routing for unambiguous messages.
+    Returns None when nothing matches, when categories conflict,
+    when the message is negated, or when negative-mood or self-harm
+    wording appears (always judged semantically).
+    """
+    lower = text.lower().replace("’", "'")
+    if INTENT_RE.search(lower):
+        return None
+
+    tokens = {tok.strip(string.punctuation) for tok in lower.split()}
+    if tokens & NEGATION_WORDS or any(tok.endswith("n't") for tok in tokens):
+        return None
+    if tokens & NEGATIVE_WORDS:
+        return None
+    found = {intent for intent, words in KEYWORD_GROUPS if tokens & words}
+    if HAS_DIGIT_RE.search(lower):
+        if SUBJECT_SCORE_RE.search(text):
+            # "Maths - 90", "95 in Physics": a marks report even without keywords
+            found.add("academic")
+        elif not ("academic" in found and SUBJ_SCORE_FALLBACK.search(text)):
+            # The loose "English 88" form also matches "slept 5 hours", so it
+            # needs an academic keyword; other numbers must not be saved
+            return None
+    if len(found) != 1:
+        return None
+    return found.pop()
 
-def classify_intent(text: str) -> str:
+
+# ---------------------------
+# LLM Response Cache
+# ---------------------------
+
+# Short-lived cache of LLM replies keyed by prompt hash, plus the calls
+# currently in flight so identical concurrent prompts share one request.
+_RESPONSE_CACHE: OrderedDict[str, Tuple[float, str]] = OrderedDict()
+_INFLIGHT: Dict[str, Future] = {}
+_CACHE_LOCK = threading.Lock()
+RESPONSE_CACHE_MAX = 1024
+
+
+def _claim_prompt(key: str, ttl: int) -> Tuple[Optional[str], Optional[Future], bool]:
+    """
+    Look up a prompt key.
+    Returns (cached reply, future, owner): a fresh hit comes back directly;
+    otherwise the caller either owns a new in-flight future or waits on one.
+    """
+    with _CACHE_LOCK:
+        hit = _RESPONSE_CACHE.get(key)
+        if hit is not None and time.monotonic() - hit[0] < ttl:
+            _RESPONSE_CACHE.move_to_end(key)
+            return hit[1], None, False
+        pending = _INFLIGHT.get(key)
+        if pending is not None:
+            return None, pending, False
+        fut = _INFLIGHT[key] = Future()
+        return None, fut, True
+
+
+def _settle_prompt(
+    key: str,
+    fut: Future,
+    content: Optional[str] = None,
+    exc: Optional[BaseException] = None,
+) -> None:
+    """
+    Store an owner's result (or failure) and release waiting callers.
+    An owner that was cancelled fails its waiters with a plain error, so
+    they are not mistaken for cancelled themselves.
+    """
+    with _CACHE_LOCK:
+        if exc is None:
+            _RESPONSE_CACHE[key] = (time.monotonic(), content)
+            if len(_RESPONSE_CACHE) > RESPONSE_CACHE_MAX:
+                _RESPONSE_CACHE.popitem(last=False)
+        del _INFLIGHT[key]
+    if fut.cancelled():
+        return
+    if exc is None:
+        fut.set_result(content)
+    elif isinstance(exc, Exception):
+        fut.set_exception(exc)
+    else:
+        fut.set_exception(RuntimeError("LLM call for this prompt was cancelled"))
+
+
+def cached_invoke(prompt: str, ttl: int = 60, **kwargs) -> str:
     """
-    LLM classifies message meaning → determines correct tool.
-    Suicide context is only 'safety' when intent is real and personal.
+    llm.invoke with a TTL response cache and in-flight de-duplication.
+    Only meant for short, deterministic-ish outputs (e.g. intent labels).
+    """
+    key = hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+    cached, fut, owner = _claim_prompt(key, ttl)
+    if cached is not None:
+        return cached
+    if not owner:
+        # Same prompt already being answered → wait for that result
+        return fut.result()
+
+    try:
+        content = llm.invoke(prompt, **kwargs).content
+    except BaseException as exc:  # incl. CancelledError: never strand waiters
+        _settle_prompt(key, fut, exc=exc)
+        raise
+    _settle_prompt(key, fut, content)
+    return content
+
+
+async def cached_invoke_async(prompt: str, ttl: int = 60, **kwargs) -> str:
+    """
+    Async variant of cached_invoke; shares the same cache and in-flight table.
     """
-    prompt = f"""
+    key = hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+    cached, fut, owner = _claim_prompt(key, ttl)
+    if cached is not None:
+        return cached
+    if not owner:
+        # Shielded: a cancelled waiter must not cancel the shared future
+        return await asyncio.shield(asyncio.wrap_future(fut))
+
+    try:
+        content = (await llm.ainvoke(prompt, **kwargs)).content
+    except BaseException as exc:  # incl. CancelledError: never strand waiters
+        _settle_prompt(key, fut, exc=exc)
+        raise
+    _settle_prompt(key, fut, content)
+    return content
+
+
+# ---------------------------
+# Semantic Intent Classifier
+# ---------------------------
+
+
+def _intent_prompt(text: str) -> str:
+    return f"""
 Classify intent of the message:
 
-"{text}"
+"{text.lower()}"
 
 Rules:
 - Only classify "safety" if the speaker expresses real personal intent to self-harm.
@@ -316,7 +636,24 @@ Rules:
 Return one word:
 academic | positive | negative | safety | generic | unclear
 """
-    return llm.invoke(prompt).content.strip().lower()
+
+
+def classify_intent(text: str) -> str:
+    """
+    LLM classifies message meaning → determines correct tool.
+    Suicide context is only 'safety' when intent is real and personal.
+    """
+    # A single label is expected, so cap generation instead of letting it pad.
+    # Lowercased text makes repeated messages share one cached label.
+    return cached_invoke(_intent_prompt(text), max_tokens=4).strip().lower()
+
+
+async def classify_intent_async(text: str) -> str:
+    """
+    Async variant of classify_intent.
+    """
+    label = await cached_invoke_async(_intent_prompt(text), max_tokens=4)
+    return label.strip().lower()
 
 
 # ---------------------------
@@ -324,15 +661,31 @@ academic | positive | negative | safety | generic | unclear
 # ---------------------------
 
 
+_NAME_PREFIXES = ("my name is ", "i am ", "i'm ", "this is ")
+
+
 def extract_name(text: str) -> str:
     """
     Extract user's name if they introduce themselves.
     Fallback: use last token as a name.
     """
-    m = re.search(r"(?:my name is|i am|i'm|this is)\s+([A-Za-z]+)", text, re.IGNORECASE)
-    if m:
-        return m.group(1).title()
-    return (text.strip().split()[-1] or "Friend").title()
+    stripped = text.strip()
+    lower = stripped.lower()
+
+    # Earliest introduction phrase wins, found with plain str.find
+    start = -1
+    for prefix in _NAME_PREFIXES:
+        i = lower.find(prefix)
+        if i != -1 and (start == -1 or i < start):
+            start = i + len(prefix)
+    if start != -1:
+        rest = stripped[start:].split()
+        if rest:
+            word = rest[0].strip(string.punctuation)
+            if word.isalpha():
+                return word.title()
+
+    return (stripped.split()[-1] or "Friend").title()
 
 
 def set_name(name: str, session_id: str = "default") -> str:
@@ -343,9 +696,7 @@ def set_name(name: str, session_id: str = "default") -> str:
     clean = extract_name(name)
     session["name"] = clean
 
-    get_memory(session_id).save_context(
-        {"input": name}, {"output": f"Stored name: {clean}."}
-    )
+    remember_async(session_id, name, f"Stored name: {clean}.")
     return f"Nice to meet you, {clean}. What should we do next?"
 
 
@@ -354,44 +705,59 @@ def set_name(name: str, session_id: str = "default") -> str:
 # ---------------------------
 
 
-def chat(message: str, session_id: str = "default") -> str:
+def _start_turn(message: str, session_id: str) -> Tuple[str, Optional[str]]:
     """
-    Main entrypoint:
-    - Name collection (first message)
-    - Semantic intent routing (classification)
-    - Tool chosen by context, not keywords
-    - Safety clarification when uncertain
+    Shared start of a turn: clean the text and answer the cases that need
+    no routing (empty message, first message → name).
     """
     session = get_or_create_session(session_id)
     name = session.get("name")
-    agent = get_agent(session_id)
 
     text = (message or "").strip()
     if not text:
-        return "Please type something."
+        return text, "Please type something."
 
     if name is None:
         # First message → assume name
-        return set_name(text, session_id)
+        return text, set_name(text, session_id)
+    return text, None
 
-    # Classify semantic meaning of the message
-    intent = classify_intent(text)
 
-    # Route based on model intelligence
+def _unclassified(text: str) -> str:
+    """
+    Intent used when the semantic classifier is disabled.
+    Self-harm wording is never handed to the agent; it gets the
+    clarification question instead.
+    """
+    return "unclear" if INTENT_RE.search(text.lower()) else "generic"
+
+
+def _local_reply(intent: str, text: str, session_id: str) -> Optional[str]:
+    """
+    Replies for intents that need no LLM call; None for the rest.
+    """
     if intent == "academic":
-        reply = student_marks_tool(text, session_id)
-    elif intent == "positive":
-        reply = positive_prompt_tool(text, session_id)
-    elif intent == "negative":
-        reply = negative_prompt_tool(text, session_id)
-    elif intent == "safety":
-        reply = self_harm_safety_tool(text, session_id)
-    elif intent == "unclear":
-        reply = clarification_question(text, session_id)
-    else:
-        # Generic fallback → agent thinking + tools
-        reply = agent.run(text)
+        return student_marks_tool(text, session_id)
+    if intent == "safety":
+        return self_harm_safety_tool(text, session_id)
+    if intent == "unclear":
+        return clarification_question(text, session_id)
+    return None
+
 
+def _finish_turn(session_id: str, text: str, reply: str, intent: str) -> str:
+    """
+    Log the turn and queue it for memory.
+    """
+    log_turn(session_id, text, reply, intent)
+    return reply
+
+
+def log_turn(session_id: str, text: str, reply: str, intent: str) -> None:
+    """
+    Record one turn in the history log and (deferred) in memory.
+    Also used by the API for turns answered from its reply caches.
+    """
     # Single structured history entry per turn
     conversation_log.setdefault(session_id, []).append(
         {
@@ -402,6 +768,111 @@ def chat(message: str, session_id: str = "default") -> str:
         }
     )
 
-    # Save response to memory for conversation context
-    get_memory(session_id).save_context({"input": text}, {"output": reply})
-    return reply
+    # Save response to memory for conversation context (deferred)
+    remember_async(session_id, text, reply)
+
+
+def chat(message: str, session_id: str = "default") -> str:
+    """
+    Main entrypoint:
+    - Name collection (first message)
+    - Semantic intent routing (classification)
+    - Keyword fast path for clear academic/positive messages only
+    - Safety clarification when uncertain
+    """
+    text, reply = _start_turn(message, session_id)
+    if reply is not None:
+        return reply
+
+    # Keyword fast path first; semantic classifier only when ambiguous
+    intent = quick_intent(text)
+    if intent is None:
+        intent = classify_intent(text) if USE_SEMANTIC_INTENT else _unclassified(text)
+
+    # Route based on model intelligence
+    reply = _local_reply(intent, text, session_id)
+    if reply is None:
+        if intent == "positive":
+            reply = positive_prompt_tool(text, session_id)
+        elif intent == "negative":
+            reply = negative_prompt_tool(text, session_id)
+        else:
+            # Generic fallback → agent thinking + tools
+            reply = get_agent(session_id).run(text)
+
+    return _finish_turn(session_id, text, reply, intent)
+
+
+async def _route_async(text: str) -> str:
+    """
+    Async intent routing: keyword fast path, then the semantic classifier.
+    """
+    intent = quick_intent(text)
+    if intent is None:
+        if USE_SEMANTIC_INTENT:
+            intent = await classify_intent_async(text)
+        else:
+            intent = _unclassified(text)
+    return intent
+
+
+async def chat_async(
+    message: str, session_id: str = "default"
+) -> Tuple[str, Optional[str]]:
+    """
+    Async variant of chat for the API: same routing, LLM calls are awaited
+    on the shared client instead of blocking a thread.
+    Returns (reply, routed intent); intent is None for turns answered
+    before routing (empty message, name capture).
+    """
+    text, reply = _start_turn(message, session_id)
+    if reply is not None:
+        return reply, None
+
+    intent = await _route_async(text)
+    reply = _local_reply(intent, text, session_id)
+    if reply is None:
+        if intent == "positive":
+            reply = await positive_prompt_tool_async(text, session_id)
+        elif intent == "negative":
+            reply = await negative_prompt_tool_async(text, session_id)
+        else:
+            reply = await get_agent(session_id).arun(text)
+
+    return _finish_turn(session_id, text, reply, intent), intent
+
+
+async def chat_stream(message: str, session_id: str = "default") -> AsyncIterator[str]:
+    """
+    Streaming variant of chat_async.
+    Emotion tools yield LLM tokens as they arrive; every other reply
+    (tables, safety text, agent answers) is yielded as one chunk.
+    The turn is logged even if the client disconnects mid-stream
+    (streamed replies with the text sent so far).
+    """
+    text, reply = _start_turn(message, session_id)
+    if reply is not None:
+        yield reply
+        return
+
+    intent = await _route_async(text)
+    reply = _local_reply(intent, text, session_id)
+    if reply is None and intent in ("positive", "negative"):
+        prefix = POSITIVE_PREFIX if intent == "positive" else NEGATIVE_PREFIX
+        parts = []
+        try:
+            async for chunk in llm.astream(_tool_prompt(prefix, text, session_id)):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield chunk.content
+        finally:
+            if parts:
+                _finish_turn(session_id, text, "".join(parts).strip(), intent)
+        return
+
+    if reply is None:
+        reply = await get_agent(session_id).arun(text)
+    try:
+        yield reply
+    finally:
+        _finish_turn(session_id, text, reply, intent)
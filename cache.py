@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import re
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+EXACT_CACHE_MAX = 10_000
+# Time-sensitive questions must always be answered fresh
+NO_CACHE_RE = re.compile(r"\b(?:today|now|current|time)\b", re.IGNORECASE)
+
+# Small local embedding model (384-dim, ~10ms per message on CPU)
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+SIMILARITY_THRESHOLD = 0.92
+SEMANTIC_CACHE_MAX = 1024  # total stored (embedding, reply) pairs
+
+
+class ExactCache:
+    """
+    O(1) reply cache keyed by SHA-256 of session id, session state and message.
+    Catches refresh/retry storms before any embedding work; FIFO eviction.
+    """
+
+    def __init__(self, max_entries: int = EXACT_CACHE_MAX):
+        self.max_entries = max_entries
+        self._replies: Dict[str, str] = {}
+        self._order: Deque[str] = deque()
+
+    @staticmethod
+    def key(session_id: str, state: Hashable, message: str) -> str:
+        raw = f"{session_id}|{state!r}|{message}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        return self._replies.get(key)
+
+    def put(self, key: str, reply: str) -> None:
+        if key not in self._replies:
+            self._order.append(key)
+            if len(self._order) > self.max_entries:
+                self._replies.pop(self._order.popleft(), None)
+        self._replies[key] = reply
+
+
+class SemanticCache:
+    """
+    Per-session reply cache matched by message embedding.
+    A lookup hits when a stored message is at least `threshold` cosine-similar
+    and was answered under the same session state.
+    The model is loaded once with load(); until then (or after a failed load)
+    `ready` is False and callers skip the cache.
+    """
+
+    def __init__(
+        self,
+        threshold: float = SIMILARITY_THRESHOLD,
+        max_entries: int = SEMANTIC_CACHE_MAX,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # session_id -> (state, stacked unit vectors (N, dim), replies)
+        self._sessions: OrderedDict[str, Tuple[Hashable, np.ndarray, List[str]]]
+        self._sessions = OrderedDict()
+        self._size = 0
+        self._model: Any = None
+        self._model_lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.enabled and self._model is not None
+
+    def load(self) -> None:
+        """
+        Load the embedding model (blocking; run it off the event loop).
+        A failed import or download disables the cache for good instead of
+        being retried on every request.
+        """
+        with self._model_lock:
+            if not self.enabled or self._model is not None:
+                return
+            try:
+                # Imported lazily: torch is only pulled in when the cache is on
+                from sentence_transformers import SentenceTransformer
+
+                self._model = SentenceTransformer(EMBED_MODEL)
+            except Exception:
+                self.enabled = False
+                raise
+
+    def _encode(self, text: str) -> np.ndarray:
+        return self._model.encode(text, normalize_embeddings=True)
+
+    async def embed(self, text: str) -> np.ndarray:
+        """
+        Unit-length embedding of text, computed off the event loop.
+        Only call once `ready` is True.
+        """
+        return await asyncio.to_thread(self._encode, text)
+
+    def lookup(
+        self, session_id: str, state: Hashable, vec: np.ndarray
+    ) -> Optional[str]:
+        """
+        Return the stored reply most similar to vec, if above threshold.
+        """
+        entry = self._sessions.get(session_id)
+        if entry is None or entry[0] != state:
+            return None
+        self._sessions.move_to_end(session_id)
+
+        # Vectors are normalized, so one dot product gives all cosine scores
+        scores = entry[1] @ vec
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            return entry[2][best]
+        return None
+
+    def store(self, session_id: str, state: Hashable, vec: np.ndarray, reply: str):
+        """
+        Remember a reply. Entries from an older session state are dropped.
+        """
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None and entry[0] == state:
+            matrix = np.vstack((entry[1], vec))
+            replies = entry[2] + [reply]
+            self._size -= len(entry[2])
+        else:
+            if entry is not None:
+                self._size -= len(entry[2])
+            matrix = vec[np.newaxis, :]
+            replies = [reply]
+
+        if len(replies) > self.max_entries:
+            matrix = matrix[-self.max_entries :]
+            replies = replies[-self.max_entries :]
+        self._sessions[session_id] = (state, matrix, replies)
+        self._size += len(replies)
+
+        # Evict least recently used sessions until back under the cap
+        while self._size > self.max_entries and len(self._sessions) > 1:
+            _, (_, _, old) = self._sessions.popitem(last=False)
+            self._size -= len(old)
@@ -1,29 +1,35 @@
+import os
 import uuid
 from typing import List, Tuple, Union
 
 import gradio as gr
-import requests
+import httpx
 
 # Backend API endpoint configuration
 API_BASE_URL = "http://127.0.0.1:8000"
 TIMEOUT_SEC = 30  # Request timeout for backend calls
 
+# Shared async client so concurrent chats overlap instead of blocking workers
+_CLIENT = httpx.AsyncClient(
+    timeout=TIMEOUT_SEC,
+    limits=httpx.Limits(max_connections=32, max_keepalive_connections=8),
+)
+
 
 HistoryTuple = Tuple[str, str]
 HistoryType = List[Union[HistoryTuple, dict]]
 
 
-def respond(message: str, history: HistoryType, session_id: str):
+async def respond(message: str, history: HistoryType, session_id: str):
     # Generate new session ID if not yet initialized
     if not session_id:
         session_id = f"user_{uuid.uuid4().hex[:6]}"
 
     try:
         # Send user message to backend API
-        resp = requests.post(
+        resp = await _CLIENT.post(
             f"{API_BASE_URL}/chat",
             json={"message": message, "session_id": session_id},
-            timeout=TIMEOUT_SEC,
         )
         resp.raise_for_status()
         reply = resp.json().get("reply", "No response.")
@@ -110,5 +116,15 @@ with gr.Blocks(title="Study Buddy") as demo:
 
 
 if __name__ == "__main__":
-    # Run Gradio on local network with share link enabled
-    demo.launch(server_name="0.0.0.0", server_port=7860, share=True)
+    # Public share tunnel only on request (SHARE=1); local runs skip it
+    share = os.environ.get("SHARE", "0") == "1"
+
+    # Faster event loop when available (installed with uvicorn[standard])
+    try:
+        import uvloop
+
+        uvloop.install()
+    except ImportError:
+        pass
+
+    demo.launch(server_name="0.0.0.0", server_port=7860, share=share)
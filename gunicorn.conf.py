@@ -0,0 +1,20 @@
+import os
+
+# Production server config:
+#   gunicorn main:app -c gunicorn.conf.py
+# For local development keep using `python main.py` (uvicorn with reload).
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+
+# One worker by default: sessions (name, marks, memory, caches) live in the
+# worker's process memory, so a second worker would not see them and a user's
+# requests would land on workers that do not know the session. Raise
+# WEB_CONCURRENCY only after session state moves out of the process.
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+worker_connections = 1000
+keepalive = 5
+
+# Leave preload_app off: bot.py's LLM/HTTP clients must be created inside
+# each worker, not shared across the fork.
+preload_app = False
@@ -1,43 +1,355 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
-from dotenv import load_dotenv
+import asyncio
+import importlib
+import logging
+import os
+import signal
+import sys
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import orjson
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 import uvicorn
 
-# Load environment variables (requires GROQ_API_KEY for LLM use)
-load_dotenv()
+# Load environment variables (requires GROQ_API_KEY for LLM use).
+# Deployed containers inject them directly, so .env is only read (and dotenv
+# only imported) when the key is missing and a .env sits next to this file.
+DOTENV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+if "GROQ_API_KEY" not in os.environ and os.path.exists(DOTENV_PATH):
+    from dotenv import load_dotenv
+
+    load_dotenv(dotenv_path=DOTENV_PATH)
+
+from cache import NO_CACHE_RE, ExactCache, SemanticCache
+
+logger = logging.getLogger("uvicorn.error")
+
+# Core chatbot logic (bot.py: LangChain + Groq client) is imported lazily so
+# the server starts accepting requests before those heavy imports finish.
+
+
+def _warmup_done(task: asyncio.Task) -> None:
+    """
+    A bot module that fails to import would fail every request, so log the
+    error and stop the server instead of serving 500s.
+    """
+    if task.cancelled() or task.exception() is None:
+        return
+    logger.error("Failed to import bot; shutting down", exc_info=task.exception())
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def _semantic_warmup_done(task: asyncio.Task) -> None:
+    """
+    The semantic cache is optional: a failed model load only disables it.
+    """
+    if task.cancelled() or task.exception() is None:
+        return
+    logger.error(
+        "Embedding model failed to load; semantic cache disabled",
+        exc_info=task.exception(),
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the bot module in the background; the first /chat then finds it
+    # already loaded (Python caches the module after the first import)
+    app.state.bot_warmup = asyncio.create_task(
+        asyncio.to_thread(importlib.import_module, "bot")
+    )
+    app.state.bot_warmup.add_done_callback(_warmup_done)
+    # Load the embedding model now rather than on some user's request;
+    # /chat skips the semantic cache until it is ready
+    if semantic_cache.enabled:
+        app.state.semantic_warmup = asyncio.create_task(
+            asyncio.to_thread(semantic_cache.load)
+        )
+        app.state.semantic_warmup.add_done_callback(_semantic_warmup_done)
+    yield
+    # Release pooled Groq connections if bot was loaded
+    if "bot" in sys.modules:
+        await sys.modules["bot"].aclose()
+
+
+# Swagger/ReDoc and the OpenAPI schema are dev-only; skipped when ENV=prod
+IS_PROD = os.getenv("ENV") == "prod"
+docs_kwargs = (
+    {"openapi_url": None, "docs_url": None, "redoc_url": None} if IS_PROD else {}
+)
+
+# Create FastAPI application instance (orjson for all JSON responses)
+app = FastAPI(
+    title="Study Buddy API",
+    version="2.0 - Agent + Grades",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+    **docs_kwargs,
+)
+
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """
+    GZip middleware that passes the listed paths through untouched.
+    Used for streaming routes, where compression would buffer the events.
+    """
+
+    def __init__(self, app, exclude_paths=(), **kwargs):
+        super().__init__(app, **kwargs)
+        self.exclude_paths = frozenset(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# Compress larger replies (grade tables, agent answers); tiny ones go as-is
+app.add_middleware(
+    SelectiveGZipMiddleware,
+    exclude_paths=("/chat/stream",),
+    minimum_size=500,
+    compresslevel=5,
+)
+
+# Exact repeat cache (checked first), then paraphrase cache for replies
+# that depend only on session state. The paraphrase cache loads torch and an
+# embedding model in every worker, so it is opt-in (USE_SEMANTIC_CACHE=1)
+USE_SEMANTIC_CACHE = os.getenv("USE_SEMANTIC_CACHE", "0") == "1"
+# Only academic-tool replies are cached (see REUSABLE_INTENTS); cache hits
+# are logged under that tool so /history stays complete
+CACHED_INTENT = "academic"
+exact_cache = ExactCache()
+semantic_cache = SemanticCache(enabled=USE_SEMANTIC_CACHE)
+
+
+class SessionRateLimiter:
+    """
+    Token bucket per session_id, checked before any LLM work.
+    Retry storms get 429s instead of queueing multi-second LLM calls.
+    """
+
+    def __init__(
+        self, burst: int = 10, per_minute: int = 10, max_sessions: int = 10_000
+    ):
+        self.burst = burst
+        self.rate = per_minute / 60.0
+        self.max_sessions = max_sessions
+        self._buckets: OrderedDict[str, Tuple[float, float]] = OrderedDict()
+
+    def allow(self, session_id: str) -> bool:
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(session_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        allowed = tokens >= 1.0
+        if allowed:
+            tokens -= 1.0
+        self._buckets[session_id] = (tokens, now)
+        if len(self._buckets) > self.max_sessions:
+            self._buckets.popitem(last=False)  # least recently seen session
+        return allowed
+
+
+rate_limiter = SessionRateLimiter()
+
 
-from bot import chat, set_name, get_recent_history, conversation_log
+def check_rate(session_id: str) -> None:
+    if not rate_limiter.allow(session_id):
+        raise HTTPException(status_code=429, detail="Too many messages, slow down.")
 
-# Import core chatbot logic
 
-# Create FastAPI application instance
-app = FastAPI(title="Study Buddy API", version="2.0 - Agent + Grades")
+# Chat turns currently being answered, keyed by (session_id, message)
+_inflight_chats: Dict[Tuple[str, str], asyncio.Future] = {}
+
+
+async def coalesced_chat(message: str, session_id: str) -> Tuple[str, Optional[str]]:
+    """
+    Run bot.chat_async, sharing one turn between identical concurrent
+    requests (e.g. client retries) instead of issuing duplicate LLM calls.
+    Returns (reply, routed intent) like chat_async.
+    """
+    from bot import chat_async
+
+    key = (session_id, message)
+    pending = _inflight_chats.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    fut = asyncio.get_running_loop().create_future()
+    _inflight_chats[key] = fut
+    try:
+        result = await chat_async(message, session_id)
+    except asyncio.CancelledError:
+        # Waiters were not cancelled themselves: give them an ordinary error
+        # (same rule as bot's prompt cache)
+        fut.set_exception(RuntimeError("Chat turn was cancelled"))
+        fut.exception()  # mark retrieved when nobody else was waiting
+        raise
+    except Exception as exc:
+        fut.set_exception(exc)
+        fut.exception()  # mark retrieved when nobody else was waiting
+        raise
+    finally:
+        del _inflight_chats[key]
+    fut.set_result(result)
+    return result
+
+
+# Session ids key every per-session store in bot; keep them short and reuse
+# one interned string per id so dict lookups hash/compare by identity
+SESSION_ID_MAX_LEN = 64
+SESSION_INTERN_MAX = 10_000
+_session_intern: Dict[str, str] = {}
+
+
+def intern_session(session_id: str) -> str:
+    """
+    Return the canonical string for a session id (bounded table).
+    """
+    canonical = _session_intern.get(session_id)
+    if canonical is not None:
+        return canonical
+    if len(_session_intern) >= SESSION_INTERN_MAX:
+        return session_id
+    canonical = _session_intern[session_id] = sys.intern(session_id)
+    return canonical
 
 
 class MessageRequest(BaseModel):
     # Request model for general chat messages
     message: str
-    session_id: str = "default"
+    session_id: str = Field("default", max_length=SESSION_ID_MAX_LEN)
 
 
 class NameRequest(BaseModel):
     # Request model for name-setting messages
     name: str
-    session_id: str = "default"
+    session_id: str = Field("default", max_length=SESSION_ID_MAX_LEN)
+
+
+# Validators built once at import; endpoints validate raw bytes with them
+# (JSON decode + field checks in one pydantic-core pass) instead of going
+# through FastAPI's per-route body resolution
+_MSG_ADAPTER = TypeAdapter(MessageRequest)
+_NAME_ADAPTER = TypeAdapter(NameRequest)
+
+
+def body_schema(model: type[BaseModel]) -> dict:
+    """
+    openapi_extra for routes that read a raw Request, so /docs still
+    documents (and can send) the JSON body.
+    """
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": model.model_json_schema()}},
+        }
+    }
+
+
+async def read_body(request: Request, adapter: TypeAdapter):
+    """
+    Validate the raw JSON body with a prebuilt adapter.
+    Failures become FastAPI's standard 422 response.
+    """
+    try:
+        return adapter.validate_json(await request.body())
+    except ValidationError as exc:
+        # Drop the raw input: FastAPI's 422 handler would decode it as UTF-8
+        raise RequestValidationError(exc.errors(include_input=False)) from exc
+
+
+# Reply endpoints return ORJSONResponse directly (response_model=None), so
+# FastAPI skips its own serialize/validate pass on the hot path
+@app.post("/chat", response_model=None, openapi_extra=body_schema(MessageRequest))
+async def chat_endpoint(request: Request):
+    from bot import HAS_DIGIT_RE, REUSABLE_INTENTS, log_turn, session_state
+
+    req = await read_body(request, _MSG_ADAPTER)
+    message, session_id = req.message, intern_session(req.session_id)
+    check_rate(session_id)
+
+    # Exact cache: same session, same marks, same message → same reply.
+    # Messages with numbers may update marks, so they always run the tools
+    state = session_state(session_id)
+    exact_key = None
+    if (
+        state is not None
+        and not HAS_DIGIT_RE.search(message)
+        and not NO_CACHE_RE.search(message)
+    ):
+        exact_key = ExactCache.key(session_id, state, message)
+        cached = exact_cache.get(exact_key)
+        if cached is not None:
+            log_turn(session_id, message.strip(), cached, CACHED_INTENT)
+            return ORJSONResponse({"reply": cached})
+
+    # Semantic cache: same rules (embeddings barely separate "Maths 80" from
+    # "Maths 90" anyway). The cache is optional: if the embedding model
+    # is off, still loading or failing, chat goes on without it
+    vec = None
+    if exact_key is not None and semantic_cache.ready:
+        try:
+            vec = await semantic_cache.embed(message)
+        except Exception:
+            logger.exception("Semantic cache unavailable; skipping it")
+        else:
+            cached = semantic_cache.lookup(session_id, state, vec)
+            if cached is not None:
+                log_turn(session_id, message.strip(), cached, CACHED_INTENT)
+                return ORJSONResponse({"reply": cached})
+
+    # Route to chatbot handler for user messages (LLM calls awaited natively)
+    reply, intent = await coalesced_chat(message, session_id)
+
+    # Reuse only replies from state-only tools (no LLM text to go stale)
+    if intent in REUSABLE_INTENTS:
+        if exact_key is not None:
+            exact_cache.put(exact_key, reply)
+        if vec is not None:
+            semantic_cache.store(session_id, state, vec, reply)
+    return ORJSONResponse({"reply": reply})
+
+
+@app.post(
+    "/chat/stream", response_model=None, openapi_extra=body_schema(MessageRequest)
+)
+async def chat_stream_endpoint(request: Request):
+    """
+    Same as /chat, but streams the reply as Server-Sent Events.
+    Each event carries a JSON-encoded text chunk; the stream ends with [DONE].
+    """
+    from bot import chat_stream
+
+    req = await read_body(request, _MSG_ADAPTER)
+    message, session_id = req.message, intern_session(req.session_id)
+    check_rate(session_id)
+
+    async def events() -> AsyncIterator[bytes]:
+        async for chunk in chat_stream(message, session_id):
+            yield b"data: " + orjson.dumps(chunk) + b"\n\n"
+        yield b"data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 
-@app.post("/chat")
-async def chat_endpoint(req: MessageRequest):
-    # Route to chatbot handler for user messages
-    reply = chat(req.message, req.session_id)
-    return {"reply": reply}
+@app.post("/set-name", response_model=None, openapi_extra=body_schema(NameRequest))
+async def set_name_endpoint(request: Request):
+    from bot import set_name
 
+    req = await read_body(request, _NAME_ADAPTER)
+    name, session_id = req.name, intern_session(req.session_id)
 
-@app.post("/set-name")
-async def set_name_endpoint(req: NameRequest):
-    # Route to explicitly assign user name
-    reply = set_name(req.name, req.session_id)
-    return {"reply": reply}
+    # Route to explicitly assign user name (no I/O; memory write is deferred)
+    reply = set_name(name, session_id)
+    return ORJSONResponse({"reply": reply})
 
 
 @app.get("/")
@@ -51,12 +363,24 @@ async def history_endpoint(session_id: str):
     """
     Return structured turn-by-turn conversation history.
     """
-    from bot import conversation_log  # local import to avoid circular issues
+    from bot import conversation_log  # lazy, see lifespan
 
     history = conversation_log.get(session_id, [])
     return {"session_id": session_id, "history": history}
 
 
 if __name__ == "__main__":
-    # Local development server entry point
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # Direct server entry point.
+    # uvloop/httptools are requested explicitly so a missing install fails loudly
+    # instead of silently falling back to asyncio/h11.
+    # Auto-reload only with ENV=dev; per-request access lines are off.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=os.getenv("ENV") == "dev",
+        loop="uvloop",
+        http="httptools",
+        access_log=False,
+        log_level="warning",
+    )